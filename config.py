@@ -1,4 +1,14 @@
 import os
+import json
+import time
+import threading
+import requests
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Online manifest listing all quadkey files of the dataset
+MANIFEST_URL = "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
 
 # User must set this to the path of the manifest CSV file
 USER_MANIFEST_PATH = os.path.join(os.path.expanduser("~"), ".ms_buildings_roads", "dataset-links.csv")
@@ -6,7 +16,125 @@ USER_MANIFEST_PATH = os.path.join(os.path.expanduser("~"), ".ms_buildings_roads"
 # Optionally, allow override via environment variable
 MANIFEST_PATH = os.environ.get("MS_BUILDINGS_MANIFEST", USER_MANIFEST_PATH)
 
+# The cached online manifest is trusted for this many seconds before checking for changes
+MANIFEST_MAX_AGE = 24 * 60 * 60
+
+# Columnar copy of the cached manifest, sorted by quadkey, for fast full reads
+MANIFEST_PARQUET_PATH = os.path.join(os.path.dirname(USER_MANIFEST_PATH), "manifest.parquet")
+
+# ETag / Last-Modified of the cached manifest, used to skip unchanged downloads
+MANIFEST_HEADERS_PATH = USER_MANIFEST_PATH + ".headers.json"
+
+# Serialises cache refreshes between the background fetch and a running algorithm
+_refresh_lock = threading.RLock()
+
 def get_manifest_path():
     if not os.path.exists(MANIFEST_PATH):
         raise FileNotFoundError(f"Manifest CSV not found at {MANIFEST_PATH}. Please download it manually and set the path in config.py or via the MS_BUILDINGS_MANIFEST environment variable.")
-    return MANIFEST_PATH 
\ No newline at end of file
+    return MANIFEST_PATH
+
+def read_manifest_csv(path):
+    """Read a manifest CSV into Arrow-backed columns, keeping quadkeys as strings so leading zeros survive"""
+    # pd.read_csv(engine='pyarrow') applies dtype only after type inference, which already dropped the zeros
+    convert_options = pa_csv.ConvertOptions(column_types={'QuadKey': pa.string()})
+    return pa_csv.read_csv(path, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
+
+def get_cached_manifest():
+    """Return the online manifest, downloading it only when the local copy is stale and has changed"""
+    if not manifest_is_stale():
+        return _read_cached_manifest()
+
+    with _refresh_lock:
+        # Another thread may have refreshed the cache while we were waiting
+        if manifest_is_stale():
+            try:
+                if os.path.exists(USER_MANIFEST_PATH) and _manifest_unchanged():
+                    # Reset the age so the next check happens in MANIFEST_MAX_AGE again,
+                    # keeping an up-to-date Parquet copy from looking older than the CSV
+                    parquet_current = _manifest_parquet_is_current()
+                    os.utime(USER_MANIFEST_PATH)
+                    if parquet_current:
+                        os.utime(MANIFEST_PARQUET_PATH)
+                else:
+                    _download_manifest()
+            except requests.RequestException:
+                # Offline: fall back to the stale copy if there is one
+                if not os.path.exists(USER_MANIFEST_PATH):
+                    raise
+
+        return _read_cached_manifest()
+
+def read_cached_manifest():
+    """Return the locally cached manifest without touching the network, or None if there is none"""
+    if not os.path.exists(USER_MANIFEST_PATH):
+        return None
+    return _read_cached_manifest()
+
+def manifest_is_stale():
+    """Whether the cached manifest is missing or older than MANIFEST_MAX_AGE"""
+    if not os.path.exists(USER_MANIFEST_PATH):
+        return True
+    return time.time() - os.path.getmtime(USER_MANIFEST_PATH) >= MANIFEST_MAX_AGE
+
+def _read_cached_manifest():
+    _ensure_manifest_parquet()
+    return pd.read_parquet(MANIFEST_PARQUET_PATH, engine='pyarrow', dtype_backend='pyarrow')
+
+def _manifest_parquet_is_current():
+    """Whether the Parquet copy exists and was built from the current CSV"""
+    return (
+        os.path.exists(MANIFEST_PARQUET_PATH)
+        and os.path.getmtime(MANIFEST_PARQUET_PATH) >= os.path.getmtime(USER_MANIFEST_PATH)
+    )
+
+def _ensure_manifest_parquet():
+    # Rebuild if missing or if an earlier rebuild failed after the CSV was replaced
+    if not _manifest_parquet_is_current():
+        with _refresh_lock:
+            if not _manifest_parquet_is_current():
+                _write_manifest_parquet()
+
+def _write_manifest_parquet():
+    manifest = read_manifest_csv(USER_MANIFEST_PATH).sort_values('QuadKey', ignore_index=True)
+    # Readers don't take the lock, so never let them see a half-written file
+    tmp_path = MANIFEST_PARQUET_PATH + ".part"
+    manifest.to_parquet(tmp_path, engine='pyarrow', index=False, row_group_size=10000)
+    os.replace(tmp_path, MANIFEST_PARQUET_PATH)
+
+def _cache_validators(headers):
+    return {key: headers[key] for key in ('ETag', 'Last-Modified') if key in headers}
+
+def _manifest_unchanged():
+    response = requests.head(MANIFEST_URL, timeout=30)
+    response.raise_for_status()
+    remote = _cache_validators(response.headers)
+
+    try:
+        with open(MANIFEST_HEADERS_PATH) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    return bool(remote) and remote == cached
+
+def _download_manifest():
+    os.makedirs(os.path.dirname(USER_MANIFEST_PATH), exist_ok=True)
+
+    with requests.get(MANIFEST_URL, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        # Write to a temporary file first so an interrupted download never replaces a good cache
+        tmp_path = USER_MANIFEST_PATH + ".part"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            os.replace(tmp_path, USER_MANIFEST_PATH)
+        except BaseException:
+            # Don't leave the partial download lying around next to the cache
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _write_manifest_parquet()
+
+        with open(MANIFEST_HEADERS_PATH, 'w') as f:
+            json.dump(_cache_validators(response.headers), f)
@@ -1,33 +1,311 @@
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QThread, pyqtSignal
 from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtWidgets import QComboBox
 from qgis.core import (
     QgsProcessingAlgorithm, 
     QgsProcessingParameterExtent, 
     QgsProcessingParameterString,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterNumber,
     QgsProcessingParameterVectorDestination,
     QgsCoordinateTransform, 
     QgsCoordinateReferenceSystem,
     QgsProject, 
     QgsProcessingException,
-    QgsVectorLayer,
     QgsProcessingMultiStepFeedback,
     QgsApplication,
-    QgsProcessingProvider
+    QgsProcessingProvider,
+    QgsTask
 )
+from processing.gui.wrappers import EnumWidgetWrapper
 import os
-import requests
-import tempfile
-import mercantile
+import asyncio
+import gzip
+import inspect
 import logging
-import pandas as pd
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import geopandas as gpd
-from shapely.geometry import shape
-import inspect
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .tiles import (
+    filter_by_quadkeys,
+    parse_features,
+    parse_polygon_tile,
+    tiles_for_bbox
+)
+from .writer import GpkgWriter
+from .config import (
+    get_cached_manifest,
+    manifest_is_stale,
+    read_cached_manifest,
+    read_manifest_csv
+)
 
 LOG_PATH = os.path.join(os.path.dirname(__file__), 'ms_buildings_roads.log')
 logging.basicConfig(filename=LOG_PATH, level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
+class TileDownloader:
+    """Downloads quadkey files and streams them into a GeoPackage
+
+    Runs on the thread of processAlgorithm, which Processing already keeps off the GUI
+    for dialog runs; progress and cancellation go through the Processing feedback.
+    """
+
+    def __init__(self, location_data, output_path, workers, keep_attributes=None, bbox=None, feedback=None):
+        self.location_data = location_data
+        self.output_path = output_path
+        self.workers = workers
+        self.keep_attributes = keep_attributes
+        self.bbox = bbox
+        self.feedback = feedback
+        self.feature_count = 0
+        self.exception = None
+        self.writer = None
+        self._write_lock = threading.Lock()
+        
+        # Size of the HTTP connection pool; the number of concurrent downloads is `workers`
+        self.pool_size = max(16, workers)
+
+    def run(self):
+        """Download all files, appending each one to the output as it arrives"""
+        rows = list(self.location_data.itertuples(index=False))
+        
+        self.writer = GpkgWriter(self.output_path, 'buildings', self.keep_attributes)
+        try:
+            if aiohttp is not None:
+                completed = asyncio.run(self._download_all_async(rows))
+            else:
+                completed = self._download_all_threaded(rows)
+        finally:
+            # Commit whatever was written, so a canceled run still leaves partial results
+            try:
+                self.writer.close()
+            except Exception as e:
+                self.exception = e
+                return False
+        
+        if not completed:
+            return False
+        
+        if self.feature_count == 0:
+            self.exception = Exception("No data could be downloaded")
+            return False
+        
+        logging.info(f"Saved {self.feature_count} features to {self.output_path}")
+        return True
+
+    async def _download_all_async(self, rows):
+        """Fetch files concurrently with aiohttp; parsing and writing run in a thread pool"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.workers)
+        
+        async def fetch(session, row):
+            # Hold the semaphore until the tile is written so at most `workers` tiles are in flight
+            async with semaphore:
+                async with session.get(row.Url) as response:
+                    response.raise_for_status()
+                    raw = await response.read()
+                return await loop.run_in_executor(
+                    executor, lambda: self._process(row, gzip.decompress(raw))
+                )
+        
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=60)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                tasks = {asyncio.ensure_future(fetch(session, row)): row.QuadKey for row in rows}
+                pending = set(tasks)
+                done_count = 0
+                
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+                    
+                    if self._is_canceled():
+                        for task in pending:
+                            task.cancel()
+                        await asyncio.gather(*pending, return_exceptions=True)
+                        return False
+                    
+                    for task in done:
+                        done_count += 1
+                        self._set_progress((done_count / len(tasks)) * 100)
+                        self._report_result(tasks[task], task)
+        
+        return True
+
+    def _download_all_threaded(self, rows):
+        """Fallback when aiohttp is not installed: fetch with a thread pool and a shared requests.Session"""
+        # One keep-alive connection pool shared by all workers, so TLS handshakes are reused
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {
+                executor.submit(self._fetch_one, session, row): row.QuadKey
+                for row in rows
+            }
+            
+            for idx, future in enumerate(as_completed(futures)):
+                if self._is_canceled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return False
+                
+                self._set_progress(((idx + 1) / len(futures)) * 100)
+                self._report_result(futures[future], future)
+        finally:
+            executor.shutdown(wait=True)
+            session.close()
+        
+        return True
+
+    def _report_result(self, quadkey, future):
+        try:
+            count = future.result()
+            self._push_info(f"Downloaded {count} features for quadkey {quadkey}")
+        except Exception as e:
+            self._report_error(f"Failed to download {quadkey}: {e}")
+
+    def _fetch_one(self, session, row):
+        """Download a single quadkey file and append it to the output, returning the feature count"""
+        with session.get(row.Url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return self._process(row, gzip.GzipFile(fileobj=response.raw).read())
+
+    def _process(self, row, data):
+        """Parse an uncompressed NDJSON tile and append it to the output, returning the feature count"""
+        parsed = parse_polygon_tile(data, self.keep_attributes)
+        if parsed is None:
+            parsed = parse_features(data.splitlines(), self.keep_attributes)
+        columns, geoms = parsed
+        
+        # Metadata goes into the constructor so the frame is assembled only once
+        columns['quadkey'] = np.full(len(geoms), row.QuadKey, dtype=object)
+        columns['location'] = np.full(len(geoms), row.Location, dtype=object)
+        gdf = gpd.GeoDataFrame(columns, geometry=geoms, crs=4326)
+        
+        # Drop buildings of the tile that lie outside the requested extent
+        if self.bbox is not None:
+            west, south, east, north = self.bbox
+            gdf = gdf.cx[west:east, south:north]
+        
+        self._write(gdf)
+        return len(gdf)
+
+    def _write(self, gdf):
+        """Append a tile to the output GeoPackage"""
+        # GPKG writes are not concurrency-safe, downloads keep running meanwhile
+        with self._write_lock:
+            self.writer.write(gdf)
+            self.feature_count += len(gdf)
+
+    def _is_canceled(self):
+        return self.feedback is not None and self.feedback.isCanceled()
+
+    def _set_progress(self, progress):
+        if self.feedback is not None:
+            self.feedback.setProgress(progress)
+
+    def _push_info(self, message):
+        if self.feedback is not None:
+            self.feedback.pushInfo(message)
+
+    def _report_error(self, message):
+        logging.warning(message)
+        if self.feedback is not None:
+            self.feedback.reportError(message)
+
+
+class ManifestTask(QgsTask):
+    """Background task that downloads or refreshes the cached manifest"""
+    
+    loaded = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__('Loading Microsoft Buildings manifest', QgsTask.CanCancel)
+        self.manifest = None
+        self.exception = None
+
+    def run(self):
+        try:
+            self.manifest = get_cached_manifest()
+        except Exception as e:
+            self.exception = e
+            return False
+        return True
+
+    def finished(self, result):
+        """Called on the main thread; hands the manifest to everyone waiting for it"""
+        global _manifest_task
+        _manifest_task = None
+        
+        if result:
+            self.loaded.emit(self.manifest)
+        else:
+            logging.warning(f"Could not load dataset from URL: {self.exception}")
+
+
+# The manifest fetch currently running, shared by all open dialogs
+_manifest_task = None
+
+def fetch_manifest_in_background(callback):
+    """Refresh the cached manifest in a QgsTask and pass it to `callback` on the main thread"""
+    global _manifest_task
+    # Signals are delivered to the thread that owns the receivers, so only start from the GUI thread
+    app = QCoreApplication.instance()
+    if app is None or QThread.currentThread() != app.thread():
+        return
+    
+    if _manifest_task is None:
+        _manifest_task = ManifestTask()
+        _manifest_task.loaded.connect(callback)
+        QgsApplication.taskManager().addTask(_manifest_task)
+    else:
+        _manifest_task.loaded.connect(callback)
+
+
+class LocationWidgetWrapper(EnumWidgetWrapper):
+    """Location combo box that refreshes a missing or stale manifest while the dialog is open
+
+    The fetch is started here rather than in initAlgorithm, so loading the provider at
+    QGIS startup never touches the network. Only this widget is updated; the instance
+    that runs the algorithm reads the refreshed cache when it is created.
+    """
+
+    def createWidget(self, *args, **kwargs):
+        widget = super().createWidget(*args, **kwargs)
+        self.combo = widget if isinstance(widget, QComboBox) else None
+        if self.combo is not None and manifest_is_stale():
+            fetch_manifest_in_background(self.on_manifest_loaded)
+        return widget
+
+    def on_manifest_loaded(self, dataset_links):
+        options = MSBuildingsDownloaderAlgorithm.get_location_options(dataset_links)
+        try:
+            self.parameterDefinition().setOptions(options)
+            selected = self.combo.currentText()
+            self.combo.clear()
+            for i, option in enumerate(options):
+                self.combo.addItem(option, i)
+            self.combo.setCurrentIndex(max(self.combo.findText(selected), 0))
+        except RuntimeError:
+            # The dialog has been closed
+            pass
+
+
 class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
     """Processing algorithm for downloading Microsoft Buildings/Roads data"""
     
@@ -36,31 +314,37 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
     LOCATION = 'LOCATION'
     DATA_TYPE = 'DATA_TYPE'
     CSV_PATH = 'CSV_PATH'
+    WORKERS = 'WORKERS'
+    ATTRIBUTES = 'ATTRIBUTES'
+    CUSTOM_AREA = 'Custom Area (use extent below)'
 
     def __init__(self):
         super().__init__()
         self.dataset_links = None
+        self.quadkey_index = None
+        self.location_options = [self.CUSTOM_AREA]
 
     def initAlgorithm(self, config):
         """Initialize the algorithm parameters"""
-        # Location selection - try to load locations from CSV
-        location_options = ['Custom Area (use extent below)']
+        # Location selection - only use the manifest already on disk, so listing the
+        # algorithm never waits on the network; the dialog fetches a missing or stale copy
+        # and checkParameterValues loads one for runs without a dialog
         try:
-            self.dataset_links = pd.read_csv("https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv")
-            locations = sorted(self.dataset_links['Location'].unique())
-            location_options.extend(locations)
+            manifest = read_cached_manifest()
+            if manifest is not None:
+                self.set_dataset_links(manifest)
         except Exception as e:
-            logging.warning(f"Could not load dataset from URL: {e}")
-            
-        self.addParameter(
-            QgsProcessingParameterEnum(
-                'LOCATION',
-                'Select Location',
-                options=location_options,
-                allowMultiple=False,
-                defaultValue=0
-            )
+            logging.warning(f"Could not load cached dataset: {e}")
+        
+        location = QgsProcessingParameterEnum(
+            'LOCATION',
+            'Select Location',
+            options=self.location_options,
+            allowMultiple=False,
+            defaultValue=0
         )
+        location.setMetadata({'widget_wrapper': {'class': LocationWidgetWrapper}})
+        self.addParameter(location)
         
         self.addParameter(
             QgsProcessingParameterExtent(
@@ -91,6 +375,27 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
             )
         )
         
+        self.addParameter(
+            QgsProcessingParameterString(
+                'ATTRIBUTES',
+                'Attributes to keep (comma-separated, leave empty for geometry only)',
+                multiLine=False,
+                optional=True,
+                defaultValue='height,confidence'
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                'Number of parallel downloads',
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                maxValue=32,
+                defaultValue=8
+            )
+        )
+        
         self.addParameter(
             QgsProcessingParameterVectorDestination(
                 self.OUTPUT,
@@ -100,7 +405,6 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
 
     def processAlgorithm(self, parameters, context, feedback):
         """Execute the algorithm"""
-        
         # Setup feedback
         multi_step_feedback = QgsProcessingMultiStepFeedback(4, feedback)
         
@@ -111,14 +415,14 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
         csv_path = self.parameterAsString(parameters, 'CSV_PATH', context)
         if csv_path:
             try:
-                self.dataset_links = pd.read_csv(csv_path)
+                self.set_dataset_links(read_manifest_csv(csv_path))
                 feedback.pushInfo(f"Loaded dataset from local file: {csv_path}")
             except Exception as e:
                 raise QgsProcessingException(f"Could not load CSV file: {str(e)}")
         elif self.dataset_links is None:
             try:
-                self.dataset_links = pd.read_csv("https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv")
-                feedback.pushInfo("Loaded dataset from online source")
+                self.set_dataset_links(get_cached_manifest())
+                feedback.pushInfo("Loaded dataset from online source (cached)")
             except Exception as e:
                 raise QgsProcessingException(f"Could not load dataset: {str(e)}")
         
@@ -127,13 +431,10 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
         multi_step_feedback.pushInfo("Determining area of interest...")
         
         location_index = self.parameterAsEnum(parameters, 'LOCATION', context)
-        location_options = ['Custom Area (use extent below)']
-        locations = sorted(self.dataset_links['Location'].unique())
-        location_options.extend(locations)
+        bbox = None
+        selected_location = self.location_options[location_index]
         
-        selected_location = location_options[location_index]
-        
-        if selected_location == 'Custom Area (use extent below)':
+        if selected_location == self.CUSTOM_AREA:
             # Use extent parameter - this is required for custom areas
             extent_param = parameters.get('EXTENT')
             if not extent_param:
@@ -161,8 +462,11 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
             if not quadkeys:
                 raise QgsProcessingException("No building data available for this extent")
             
+            # Downloaded tiles are clipped to this extent
+            bbox = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+            
             # Filter dataset for these quadkeys
-            location_data = self.dataset_links[self.dataset_links['QuadKey'].isin(quadkeys)]
+            location_data = self.filter_by_quadkeys(quadkeys)
             
         else:
             # Use predefined location - extent is ignored
@@ -170,84 +474,107 @@ class MSBuildingsDownloaderAlgorithm(QgsProcessingAlgorithm):
             location_data = self.dataset_links[self.dataset_links['Location'] == selected_location]
         
         if len(location_data) == 0:
-            raise QgsProcessingException(f"No data found for the selected area")
+            raise QgsProcessingException("No data found for the selected area")
         
         # Step 3: Download data
         multi_step_feedback.setCurrentStep(2)
         multi_step_feedback.pushInfo(f"Downloading {len(location_data)} data files...")
         
-        all_gdfs = []
-        for idx, (_, row) in enumerate(location_data.iterrows()):
-            if feedback.isCanceled():
-                break
-                
-            progress = int((idx / len(location_data)) * 100)
-            multi_step_feedback.setProgress(progress)
-            feedback.pushInfo(f"Downloading quadkey {row.QuadKey}...")
-            
-            try:
-                # Download and process the file
-                df = pd.read_json(row.Url, lines=True, compression='gzip')
-                df['geometry'] = df['geometry'].apply(shape)
-                gdf = gpd.GeoDataFrame(df, crs=4326)
-                
-                # Add metadata
-                gdf['quadkey'] = row.QuadKey
-                gdf['location'] = row.Location
-                
-                all_gdfs.append(gdf)
-                
-            except Exception as e:
-                feedback.reportError(f"Failed to download {row.QuadKey}: {e}")
-                continue
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        attributes = self.parameterAsString(parameters, 'ATTRIBUTES', context)
+        keep_attributes = {name.strip() for name in attributes.split(',') if name.strip()}
         
-        if not all_gdfs:
-            raise QgsProcessingException("No data could be downloaded")
+        # Get output path
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
         
-        # Step 4: Process and save output
-        multi_step_feedback.setCurrentStep(3)
-        multi_step_feedback.pushInfo("Processing and saving output...")
+        # Only the output path is handed over, all layer/project access stays on this side
+        downloader = TileDownloader(location_data, output_path, workers, keep_attributes, bbox, multi_step_feedback)
+        completed = downloader.run()
         
-        # Combine all GeoDataFrames
-        combined_gdf = pd.concat(all_gdfs, ignore_index=True)
+        if downloader.exception is not None:
+            raise QgsProcessingException(str(downloader.exception))
         
-        # Get output path
-        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        if not completed or feedback.isCanceled():
+            if downloader.feature_count == 0:
+                return {}
+            feedback.pushInfo(f"Download canceled, keeping {downloader.feature_count} features already saved")
+            return {self.OUTPUT: output_path}
         
-        # Save to output file
-        combined_gdf.to_file(output_path, driver="GPKG")
+        # Step 4: Process and save output
+        multi_step_feedback.setCurrentStep(3)
         
-        feedback.pushInfo(f"Successfully downloaded {len(combined_gdf)} features")
+        feedback.pushInfo(f"Successfully downloaded {downloader.feature_count} features")
         
         return {self.OUTPUT: output_path}
 
+    def checkParameterValues(self, parameters, context):
+        """Load the manifest the LOCATION index refers to before it is validated"""
+        # Scripts and qgis_process pass a location index without a dialog having fetched the
+        # manifest; processAlgorithm runs on a fresh instance that then reads the same cache
+        csv_path = self.parameterAsString(parameters, 'CSV_PATH', context)
+        if not csv_path and _manifest_task is not None:
+            # The dialog's fetch holds the refresh lock for the whole download, so waiting
+            # for it here would freeze the GUI; the cache may also change under the index
+            return False, "The location list is still being downloaded, please try again in a moment"
+        
+        if csv_path or self.dataset_links is None or manifest_is_stale():
+            try:
+                self.set_dataset_links(read_manifest_csv(csv_path) if csv_path else get_cached_manifest())
+            except Exception as e:
+                return False, f"Could not load dataset: {e}"
+            self.parameterDefinition('LOCATION').setOptions(self.location_options)
+        
+        return super().checkParameterValues(parameters, context)
+
+    @classmethod
+    def get_location_options(cls, dataset_links):
+        """LOCATION choices for a manifest: the custom area followed by its locations"""
+        return [cls.CUSTOM_AREA] + sorted(dataset_links['Location'].unique().tolist())
+
+    def set_dataset_links(self, dataset_links):
+        """Store the manifest sorted by quadkey so it can be searched by prefix, and its location list"""
+        self.dataset_links = dataset_links.sort_values('QuadKey', ignore_index=True)
+        self.quadkey_index = self.dataset_links['QuadKey'].to_numpy(dtype=str)
+        self.location_options = self.get_location_options(self.dataset_links)
+
+    def filter_by_quadkeys(self, quadkeys):
+        """Select manifest rows equal to or nested within the given quadkeys"""
+        return filter_by_quadkeys(self.dataset_links, self.quadkey_index, quadkeys)
+
     def get_quadkeys_for_bbox(self, west, south, east, north, feedback):
         """Get quadkeys that intersect with a bounding box using mercantile"""
         quadkeys = set()
         
         feedback.pushInfo(f"Computing quadkeys for bbox: {west}, {south}, {east}, {north}")
         
-        # Use multiple zoom levels to get comprehensive coverage
-        # Microsoft uses various zoom levels, typically 9-12
-        for zoom_level in range(9, 13):
-            try:
-                # Use mercantile to get tiles that intersect the bounding box
-                tiles = list(mercantile.tiles(west, south, east, north, zoom_level))
-                
-                feedback.pushInfo(f"Found {len(tiles)} tiles at zoom level {zoom_level}")
+        # Only the manifest's own zoom level can match, so don't fan out over others
+        zoom_level = self.get_manifest_zoom()
+        
+        try:
+            # Round outwards so nearly identical extents share a cache entry without losing tiles
+            tile_quadkeys = tiles_for_bbox(
+                math.floor(west * 1e4) / 1e4, math.floor(south * 1e4) / 1e4,
+                math.ceil(east * 1e4) / 1e4, math.ceil(north * 1e4) / 1e4,
+                zoom_level
+            )
+            
+            feedback.pushInfo(f"Found {len(tile_quadkeys)} tiles at zoom level {zoom_level}")
+            quadkeys.update(tile_quadkeys)
                 
-                # Convert tiles to quadkeys using mercantile
-                for tile in tiles:
-                    quadkey = mercantile.quadkey(tile)
-                    quadkeys.add(quadkey)
-                    
-            except Exception as e:
-                feedback.reportError(f"Error getting tiles for zoom {zoom_level}: {e}")
-                continue
+        except Exception as e:
+            feedback.reportError(f"Error getting tiles for zoom {zoom_level}: {e}")
         
         feedback.pushInfo(f"Total unique quadkeys found: {len(quadkeys)}")
         return list(quadkeys)
 
+    def get_manifest_zoom(self):
+        """Zoom level of the manifest's quadkeys, falling back to 9 if it can't be determined"""
+        try:
+            return int(self.dataset_links['QuadKey'].str.len().iloc[0])
+        except Exception as e:
+            logging.warning(f"Could not determine manifest zoom level: {e}")
+            return 9
+
     def name(self):
         return 'ms_buildings_downloader'
 
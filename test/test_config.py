@@ -0,0 +1,195 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+import requests
+
+# config.py has no QGIS dependency, so it can be imported without the plugin package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+OLD_MANIFEST = b"Location,QuadKey,Url,Size\nA,0123,https://example.com/a.csv.gz,1\nB,0130,https://example.com/b.csv.gz,1\n"
+NEW_MANIFEST = OLD_MANIFEST + b"C,0131,https://example.com/c.csv.gz,1\n"
+
+# Seeding the cache must not count as a rebuild in the tests that record them
+write_manifest_parquet = config._write_manifest_parquet
+
+
+class FakeResponse:
+    def __init__(self, body=b'', etag='"new"', fail_after=None):
+        self.headers = {'ETag': etag}
+        self.body = body
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), 16):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.ConnectionError('connection reset')
+            yield self.body[i:i + 16]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeServer:
+    """Stands in for requests.head/requests.get and records which of them were called"""
+
+    def __init__(self, body=NEW_MANIFEST, etag='"new"', offline=False, fail_after=None):
+        self.body = body
+        self.etag = etag
+        self.offline = offline
+        self.fail_after = fail_after
+        self.calls = []
+
+    def head(self, url, timeout):
+        self.calls.append('HEAD')
+        if self.offline:
+            raise requests.ConnectionError('offline')
+        return FakeResponse(etag=self.etag)
+
+    def get(self, url, stream, timeout):
+        self.calls.append('GET')
+        if self.offline:
+            raise requests.ConnectionError('offline')
+        return FakeResponse(self.body, self.etag, self.fail_after)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'USER_MANIFEST_PATH', str(tmp_path / 'dataset-links.csv'))
+    monkeypatch.setattr(config, 'MANIFEST_PARQUET_PATH', str(tmp_path / 'manifest.parquet'))
+    monkeypatch.setattr(config, 'MANIFEST_HEADERS_PATH', str(tmp_path / 'dataset-links.csv.headers.json'))
+    return tmp_path
+
+
+@pytest.fixture
+def server(monkeypatch):
+    def install(**kwargs):
+        fake = FakeServer(**kwargs)
+        monkeypatch.setattr(config.requests, 'head', fake.head)
+        monkeypatch.setattr(config.requests, 'get', fake.get)
+        return fake
+    return install
+
+
+@pytest.fixture
+def parquet_writes(monkeypatch):
+    writes = []
+
+    def record():
+        writes.append(time.time())
+        write_manifest_parquet()
+
+    monkeypatch.setattr(config, '_write_manifest_parquet', record)
+    return writes
+
+
+def seed_cache(age, etag='"old"'):
+    """Write a cached manifest with its Parquet copy and validators, `age` seconds old"""
+    with open(config.USER_MANIFEST_PATH, 'wb') as f:
+        f.write(OLD_MANIFEST)
+    with open(config.MANIFEST_HEADERS_PATH, 'w') as f:
+        json.dump({'ETag': etag}, f)
+    write_manifest_parquet()
+
+    mtime = time.time() - age
+    os.utime(config.USER_MANIFEST_PATH, (mtime, mtime))
+    os.utime(config.MANIFEST_PARQUET_PATH, (mtime, mtime))
+
+
+def locations(manifest):
+    return manifest['Location'].tolist()
+
+
+def test_fresh_cache_is_read_without_network(cache, server, parquet_writes):
+    seed_cache(age=60)
+    fake = server()
+
+    manifest = config.get_cached_manifest()
+
+    assert fake.calls == []
+    assert parquet_writes == []
+    assert locations(manifest) == ['A', 'B']
+    # Quadkeys keep their leading zeros
+    assert manifest['QuadKey'].tolist() == ['0123', '0130']
+
+
+def test_stale_unchanged_cache_only_resets_its_age(cache, server, parquet_writes):
+    seed_cache(age=config.MANIFEST_MAX_AGE + 60, etag='"same"')
+    fake = server(etag='"same"')
+
+    manifest = config.get_cached_manifest()
+
+    assert fake.calls == ['HEAD']
+    assert parquet_writes == []
+    assert not config.manifest_is_stale()
+    assert config._manifest_parquet_is_current()
+    assert locations(manifest) == ['A', 'B']
+
+
+def test_stale_changed_cache_is_downloaded_and_rebuilt(cache, server, parquet_writes):
+    seed_cache(age=config.MANIFEST_MAX_AGE + 60)
+    fake = server(etag='"new"')
+
+    manifest = config.get_cached_manifest()
+
+    assert fake.calls == ['HEAD', 'GET']
+    assert len(parquet_writes) == 1
+    assert not config.manifest_is_stale()
+    assert locations(manifest) == ['A', 'B', 'C']
+    with open(config.MANIFEST_HEADERS_PATH) as f:
+        assert json.load(f) == {'ETag': '"new"'}
+
+
+def test_missing_cache_is_downloaded(cache, server):
+    fake = server()
+
+    assert locations(config.get_cached_manifest()) == ['A', 'B', 'C']
+    assert fake.calls == ['GET']
+
+
+def test_offline_falls_back_to_stale_copy(cache, server, parquet_writes):
+    seed_cache(age=config.MANIFEST_MAX_AGE + 60)
+    server(offline=True)
+
+    assert locations(config.get_cached_manifest()) == ['A', 'B']
+    assert parquet_writes == []
+    # Still stale, so the next run tries again
+    assert config.manifest_is_stale()
+
+
+def test_offline_without_cache_raises(cache, server):
+    server(offline=True)
+
+    with pytest.raises(requests.ConnectionError):
+        config.get_cached_manifest()
+
+
+def test_interrupted_download_keeps_old_cache(cache, server, parquet_writes):
+    seed_cache(age=config.MANIFEST_MAX_AGE + 60)
+    server(etag='"new"', fail_after=32)
+
+    assert locations(config.get_cached_manifest()) == ['A', 'B']
+    assert parquet_writes == []
+    assert not os.path.exists(config.USER_MANIFEST_PATH + '.part')
+    with open(config.MANIFEST_HEADERS_PATH) as f:
+        assert json.load(f) == {'ETag': '"old"'}
+
+
+def test_outdated_parquet_is_rebuilt_on_read(cache, parquet_writes):
+    seed_cache(age=60)
+    with open(config.USER_MANIFEST_PATH, 'wb') as f:
+        f.write(NEW_MANIFEST)
+
+    assert locations(config.read_cached_manifest()) == ['A', 'B', 'C']
+    assert len(parquet_writes) == 1
+    assert not os.path.exists(config.MANIFEST_PARQUET_PATH + '.part')
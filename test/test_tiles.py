@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+
+import mercantile
+import numpy as np
+import pandas as pd
+import shapely
+
+# tiles.py has no QGIS dependency, so it can be imported without the plugin package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tiles import filter_by_quadkeys, parse_features, parse_polygon_tile, quadkeys_from_xy, tiles_for_bbox
+
+
+def feature(properties, coordinates, geometry_type='Polygon'):
+    return json.dumps({
+        'type': 'Feature',
+        'properties': properties,
+        'geometry': {'type': geometry_type, 'coordinates': coordinates},
+    }).encode()
+
+
+def test_quadkeys_from_xy_matches_mercantile():
+    for zoom in (1, 5, 9, 14):
+        tiles = list(mercantile.tiles(-10, 40, 12, 55, zoom))[:5000]
+        x = np.fromiter((tile.x for tile in tiles), dtype=np.uint64)
+        y = np.fromiter((tile.y for tile in tiles), dtype=np.uint64)
+        assert quadkeys_from_xy(x, y, zoom) == [mercantile.quadkey(tile) for tile in tiles]
+
+
+def test_tiles_for_bbox_keeps_leading_zeros():
+    # Tiles in the north-west quadrant all start with '0'
+    quadkeys = tiles_for_bbox(-100.0, 40.0, -99.0, 41.0, 9)
+    expected = {mercantile.quadkey(tile) for tile in mercantile.tiles(-100.0, 40.0, -99.0, 41.0, 9)}
+    assert quadkeys == expected
+    assert all(qk.startswith('0') and len(qk) == 9 for qk in quadkeys)
+
+
+def test_parse_polygon_tile_matches_parse_features():
+    shell = [[0, 0], [1, 0], [1, 1], [0, 0]]
+    hole = [[0.2, 0.2], [0.3, 0.2], [0.3, 0.3], [0.2, 0.2]]
+    data = b'\n'.join([
+        feature({'height': 3.5, 'confidence': 0.9}, [shell, hole]),
+        feature({'height': -1.0, 'confidence': -1.0}, [[[5, 5], [6.5, 5], [6, 6], [5, 5]]]),
+    ]) + b'\n'
+
+    columns, geoms = parse_polygon_tile(data)
+    expected_columns, expected_geoms = parse_features(data.splitlines())
+
+    assert shapely.equals(geoms, expected_geoms).all()
+    assert shapely.get_num_interior_rings(geoms[0]) == 1
+    assert list(columns['height']) == expected_columns['height']
+    assert list(columns['confidence']) == expected_columns['confidence']
+
+
+def test_parse_polygon_tile_falls_back_for_other_geometries():
+    polygon = feature({'height': 1.0}, [[[0, 0], [1, 0], [1, 1], [0, 0]]])
+    multipolygon = feature({'height': 2.0}, [[[[0, 0], [1, 0], [1, 1], [0, 0]]]], 'MultiPolygon')
+
+    assert parse_polygon_tile(polygon + b'\n' + multipolygon) is None
+    assert parse_polygon_tile(b'') is None
+
+    columns, geoms = parse_features([polygon, multipolygon])
+    assert columns['height'] == [1.0, 2.0]
+    assert list(shapely.get_type_id(geoms)) == [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+
+
+def test_parsers_only_keep_requested_properties():
+    data = feature({'height': 3.5, 'confidence': 0.9}, [[[0, 0], [1, 0], [1, 1], [0, 0]]])
+    assert set(parse_polygon_tile(data, {'height'})[0]) == {'height'}
+    assert set(parse_features([data], {'height'})[0]) == {'height'}
+    assert parse_features([data], set())[0] == {}
+
+
+def test_filter_by_quadkeys_matches_exact_and_nested_quadkeys():
+    manifest = pd.DataFrame({
+        'QuadKey': ['031313131', '120210232', '120210233', '120210300', '1202102330'],
+        'Location': ['A', 'B', 'B', 'B', 'C'],
+    }).sort_values('QuadKey', ignore_index=True)
+    index = manifest['QuadKey'].to_numpy(dtype=str)
+
+    selected = filter_by_quadkeys(manifest, index, ['120210233', '031313131'])
+    assert sorted(selected['QuadKey']) == ['031313131', '120210233', '1202102330']
+
+    # A coarser quadkey selects every manifest tile nested inside it
+    selected = filter_by_quadkeys(manifest, index, ['1202102'])
+    assert sorted(selected['QuadKey']) == ['120210232', '120210233', '1202102330']
+
+    assert filter_by_quadkeys(manifest, index, ['3']).empty
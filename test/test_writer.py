@@ -0,0 +1,128 @@
+import gc
+import os
+import sqlite3
+import sys
+
+import geopandas as gpd
+import pyogrio
+import pytest
+from shapely.geometry import MultiPolygon, box
+
+# writer.py has no QGIS dependency, so it can be imported without the plugin package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import writer
+from writer import GpkgWriter
+
+
+def tiles():
+    # The first tile has only Polygons and no confidence values, the second a
+    # MultiPolygon and fractional values, so nothing about the layer can come from tile one
+    first = gpd.GeoDataFrame(
+        {'height': [3, 4], 'confidence': [None, None], 'quadkey': ['0123', '0123'], 'location': ['A', 'A']},
+        geometry=[box(0, 0, 1, 1), box(1, 1, 2, 2)],
+        crs=4326,
+    )
+    second = gpd.GeoDataFrame(
+        {'height': [2.5], 'confidence': [0.75], 'quadkey': ['0130'], 'location': ['A']},
+        geometry=[MultiPolygon([box(3, 3, 4, 4), box(5, 5, 6, 6)])],
+        crs=4326,
+    )
+    return first, second
+
+
+@pytest.fixture(params=['arrow', 'fallback'])
+def use_arrow(request):
+    if request.param == 'arrow':
+        pytest.importorskip('osgeo')
+        if not hasattr(writer.ogr.Layer, 'WritePyArrow'):
+            pytest.skip('GDAL without the Arrow write API')
+    return request.param == 'arrow'
+
+
+def write(path, frames, use_arrow, attributes=None):
+    gpkg = GpkgWriter(str(path), 'buildings', attributes)
+    gpkg.use_arrow = use_arrow
+    try:
+        for frame in frames:
+            gpkg.write(frame)
+    finally:
+        gpkg.close()
+
+
+def test_schema_does_not_depend_on_first_tile(tmp_path, use_arrow):
+    path = tmp_path / 'out.gpkg'
+    write(path, tiles(), use_arrow)
+
+    info = pyogrio.read_info(path, layer='buildings')
+    assert info['features'] == 3
+    assert info['geometry_type'] == 'Unknown'
+    assert dict(zip(info['fields'], info['dtypes'])) == {
+        'confidence': 'float64', 'height': 'float64', 'quadkey': 'object', 'location': 'object',
+    }
+
+    result = gpd.read_file(path, layer='buildings')
+    assert result.geom_type.tolist() == ['Polygon', 'Polygon', 'MultiPolygon']
+    assert result.quadkey.tolist() == ['0123', '0123', '0130']
+    assert result.confidence.isna().tolist() == [True, True, False]
+
+
+def test_declared_attributes_only(tmp_path, use_arrow):
+    path = tmp_path / 'out.gpkg'
+    first, second = tiles()
+    write(path, [first.drop(columns='height'), second], use_arrow, attributes={'height'})
+
+    info = pyogrio.read_info(path, layer='buildings')
+    assert list(info['fields']) == ['height', 'quadkey', 'location']
+    assert gpd.read_file(path, layer='buildings').height.isna().tolist() == [True, True, False]
+
+
+def test_existing_file_that_is_not_a_geopackage(tmp_path):
+    pytest.importorskip('osgeo')
+    path = tmp_path / 'out.gpkg'
+    path.write_text('not a geopackage')
+
+    gpkg = GpkgWriter(str(path), 'buildings')
+    if not gpkg.use_arrow:
+        pytest.skip('GDAL without the Arrow write API')
+    with pytest.raises((ValueError, RuntimeError)):
+        gpkg.write(tiles()[0])
+
+
+def test_tiles_are_only_saved_once_closed(tmp_path, use_arrow):
+    if not use_arrow:
+        pytest.skip('to_file commits every tile itself')
+    first, second = tiles()
+
+    path = tmp_path / 'closed.gpkg'
+    gpkg = GpkgWriter(str(path), 'buildings')
+    gpkg.write(first)
+    gpkg.write(second)
+    gpkg.close()
+    gpkg.close()
+    assert pyogrio.read_info(path, layer='buildings')['features'] == 3
+
+    # Without close() the transaction is never committed
+    path = tmp_path / 'abandoned.gpkg'
+    gpkg = GpkgWriter(str(path), 'buildings')
+    gpkg.write(first)
+    del gpkg
+    gc.collect()
+    with sqlite3.connect(path) as db:
+        tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'buildings' not in tables
+
+
+def test_replaces_the_layer_in_an_existing_geopackage(tmp_path, use_arrow):
+    path = tmp_path / 'out.gpkg'
+    old = gpd.GeoDataFrame({'name': ['old']}, geometry=[box(0, 0, 1, 1)], crs=4326)
+    old.to_file(path, layer='buildings', engine='pyogrio')
+    old.to_file(path, layer='roads', engine='pyogrio')
+
+    write(path, tiles(), use_arrow)
+
+    assert sorted(name for name, _ in pyogrio.list_layers(path)) == ['buildings', 'roads']
+    info = pyogrio.read_info(path, layer='buildings')
+    assert info['features'] == 3
+    assert 'name' not in info['fields']
+    assert pyogrio.read_info(path, layer='roads')['features'] == 1
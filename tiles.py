@@ -0,0 +1,128 @@
+import functools
+
+import mercantile
+import numpy as np
+import shapely
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+def quadkeys_from_xy(x, y, zoom):
+    """Vectorized equivalent of mercantile.quadkey for arrays of tile x/y at one zoom level"""
+    if zoom == 0:
+        return [''] * len(x)
+    
+    # Interleave the bits: x goes to the even positions, y to the odd ones
+    qk_int = np.zeros(len(x), dtype=np.uint64)
+    for i in range(zoom):
+        bit = np.uint64(i)
+        qk_int |= ((x >> bit) & np.uint64(1)) << np.uint64(2 * i)
+        qk_int |= ((y >> bit) & np.uint64(1)) << np.uint64(2 * i + 1)
+    
+    # Base-4 digits, most significant first, as ASCII bytes viewed as fixed-width strings
+    shifts = np.arange(2 * (zoom - 1), -1, -2, dtype=np.uint64)
+    digits = ((qk_int[:, None] >> shifts) & np.uint64(3)).astype(np.uint8) + ord('0')
+    return digits.view(f'S{zoom}').ravel().astype(str).tolist()
+
+
+def parse_polygon_tile(data, keep=None):
+    """Parse an NDJSON tile of 2D Polygon features with pyarrow, returning (columns, geometries)
+    
+    Only the properties named in `keep` are converted (all of them if `keep` is None).
+
+    The JSON is decoded in C into Arrow's flat coordinate and offset buffers, which shapely
+    turns into polygons in one call. Returns None for tiles this fast path can't handle.
+    """
+    try:
+        table = pa_json.read_json(pa.BufferReader(data))
+        geometry = table.column('geometry').combine_chunks()
+        polygons = geometry.field('coordinates')  # list<ring>
+        if geometry.null_count or polygons.null_count:
+            return None
+        if not pc.all(pc.equal(geometry.field('type'), 'Polygon')).as_py():
+            return None
+        
+        rings = polygons.flatten()  # list<point>
+        points = rings.flatten()  # list<double>
+        if not pc.all(pc.equal(pc.list_value_length(points), 2)).as_py():
+            return None
+        
+        coords = points.flatten().to_numpy(zero_copy_only=False).astype(np.float64).reshape(-1, 2)
+        ring_offsets = rings.offsets.to_numpy() - rings.offsets[0].as_py()
+        polygon_offsets = polygons.offsets.to_numpy() - polygons.offsets[0].as_py()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, KeyError):
+        return None
+    
+    geoms = shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, (ring_offsets, polygon_offsets))
+    
+    columns = {}
+    if 'properties' in table.column_names:
+        properties = table.column('properties').combine_chunks()
+        if pa.types.is_struct(properties.type):
+            for field, values in zip(properties.type, properties.flatten()):
+                if keep is None or field.name in keep:
+                    columns[field.name] = values.to_numpy(zero_copy_only=False)
+    
+    return columns, geoms
+
+
+def parse_features(lines, keep=None):
+    """Parse NDJSON feature lines one by one, returning (columns, geometries) with the properties in `keep`"""
+    features = []
+    columns = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        
+        # Collect properties column-wise; keys missing from a feature are left as None
+        n = len(features)
+        for key, value in (json_loads(line).get('properties') or {}).items():
+            if keep is not None and key not in keep:
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * n
+            column.append(value)
+        for column in columns.values():
+            if len(column) == n:
+                column.append(None)
+        
+        features.append(line)
+    
+    # shapely reads the geometry member of each GeoJSON Feature, all lines in one call
+    geoms = shapely.from_geojson(np.array(features, dtype=object))
+    return columns, geoms
+
+
+@functools.lru_cache(maxsize=128)
+def tiles_for_bbox(west, south, east, north, zoom):
+    """Quadkeys of all tiles at `zoom` intersecting the bounding box"""
+    # Use mercantile to get tiles that intersect the bounding box
+    tiles = list(mercantile.tiles(west, south, east, north, zoom))
+    
+    # Convert tiles to quadkeys in one vectorized pass
+    x = np.fromiter((tile.x for tile in tiles), dtype=np.uint64, count=len(tiles))
+    y = np.fromiter((tile.y for tile in tiles), dtype=np.uint64, count=len(tiles))
+    return frozenset(quadkeys_from_xy(x, y, zoom))
+
+
+def filter_by_quadkeys(dataset_links, quadkey_index, quadkeys):
+    """Select rows of a manifest sorted by quadkey that are equal to or nested within `quadkeys`
+
+    `quadkey_index` is the manifest's QuadKey column as a sorted numpy string array.
+    """
+    # Quadkey digits are 0-3, so every child of `qk` sorts between `qk` and `qk + '4'`
+    lower = np.searchsorted(quadkey_index, np.asarray(quadkeys, dtype=str), side='left')
+    upper = np.searchsorted(quadkey_index, np.asarray([qk + '4' for qk in quadkeys], dtype=str), side='left')
+    
+    mask = np.zeros(len(quadkey_index), dtype=bool)
+    for start, stop in zip(lower, upper):
+        mask[start:stop] = True
+    
+    return dataset_links[mask]
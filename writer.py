@@ -0,0 +1,114 @@
+import os
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+
+try:
+    from osgeo import ogr, osr
+except ImportError:
+    ogr = osr = None
+
+# GeoPackage field types of the building properties and the columns added per tile.
+# Properties not listed here are written as strings.
+FIELD_TYPES = {
+    'height': pa.float64(),
+    'confidence': pa.float64(),
+    'quadkey': pa.string(),
+    'location': pa.string(),
+}
+
+
+class GpkgWriter:
+    """Appends GeoDataFrames to a GeoPackage layer through a single open GDAL dataset
+
+    The layer schema is declared up front from `attributes` (all known building
+    properties if None) plus quadkey and location, and every tile is cast to it, so
+    a tile whose values are all null or integral doesn't decide a field's type.
+    The geometry type is left generic because Polygon and MultiPolygon tiles mix.
+
+    All tiles go into one transaction that is committed by close(). Without GDAL's
+    Arrow write API (GDAL >= 3.8) every tile is appended with GeoDataFrame.to_file instead.
+    """
+
+    def __init__(self, path, layer_name, attributes=None):
+        self.path = path
+        self.layer_name = layer_name
+        self.use_arrow = ogr is not None and hasattr(ogr.Layer, 'WritePyArrow')
+        if attributes is None:
+            attributes = [name for name in FIELD_TYPES if name not in ('quadkey', 'location')]
+        self.fields = {name: FIELD_TYPES.get(name, pa.string()) for name in sorted(attributes)}
+        self.fields.update(quadkey=pa.string(), location=pa.string())
+        self._dataset = None
+        self._layer = None
+        self._mode = 'w'
+
+    def write(self, gdf):
+        if len(gdf) == 0:
+            return
+
+        table = self.to_arrow(gdf)
+        if not self.use_arrow:
+            attributes = table.drop_columns(['geometry']).to_pandas(types_mapper=pd.ArrowDtype)
+            frame = gpd.GeoDataFrame(attributes, geometry=gdf.geometry.values, crs=gdf.crs)
+            frame.to_file(
+                self.path, driver="GPKG", layer=self.layer_name, engine="pyogrio",
+                index=False, mode=self._mode, geometry_type="Unknown",
+            )
+            self._mode = 'a'
+            return
+
+        with ogr.ExceptionMgr():
+            if self._layer is None:
+                self._create_layer()
+            self._layer.WritePyArrow(table, options=['GEOMETRY_NAME=geometry'])
+
+    def close(self):
+        if self._dataset is None:
+            return
+        with ogr.ExceptionMgr():
+            self._dataset.CommitTransaction()
+        self._layer = None
+        self._dataset = None
+
+    def to_arrow(self, gdf):
+        """Return the tile as an Arrow table with exactly the declared fields and a WKB geometry column"""
+        columns = []
+        for name, arrow_type in self.fields.items():
+            if name not in gdf:
+                columns.append(pa.nulls(len(gdf), type=arrow_type))
+                continue
+            values = gdf[name]
+            if pa.types.is_string(arrow_type):
+                # Also flattens nested property values into their text form
+                values = values.astype('string')
+            else:
+                values = pd.to_numeric(values, errors='coerce')
+            columns.append(pa.array(values, from_pandas=True).cast(arrow_type))
+
+        schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type in self.fields.items()])
+        table = pa.Table.from_arrays(columns, schema=schema)
+        geometry = pa.field('geometry', pa.binary(), metadata={'ARROW:extension:name': 'ogc.wkb'})
+        return table.append_column(geometry, pa.array(gdf.geometry.to_wkb().to_numpy(), type=pa.binary()))
+
+    def _create_layer(self):
+        if os.path.exists(self.path):
+            self._dataset = ogr.Open(self.path, update=1)
+            if self._dataset is None or self._dataset.GetDriver().GetName() != 'GPKG':
+                raise ValueError(f"{self.path} exists and is not a GeoPackage that can be opened for writing")
+            for i in range(self._dataset.GetLayerCount()):
+                if self._dataset.GetLayer(i).GetName() == self.layer_name:
+                    self._dataset.DeleteLayer(i)
+                    break
+        else:
+            self._dataset = ogr.GetDriverByName('GPKG').CreateDataSource(self.path)
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        self._layer = self._dataset.CreateLayer(self.layer_name, srs, ogr.wkbUnknown, options=['GEOMETRY_NAME=geometry'])
+        for name, arrow_type in self.fields.items():
+            field_type = ogr.OFTReal if pa.types.is_floating(arrow_type) else ogr.OFTString
+            self._layer.CreateField(ogr.FieldDefn(name, field_type))
+
+        self._dataset.StartTransaction()